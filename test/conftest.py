@@ -0,0 +1,80 @@
+import ctypes
+import time
+
+import numpy as np
+import pytest
+from timeflux_amti.trace import TraceRecorder
+
+
+class FakeDLL:
+    """Minimal DLL that gives 16 samples per data call, following a script"""
+
+    def __init__(self, script):
+        # script: list of first counter values, or None when there is no data
+        self._script = list(script)
+
+    def fmDLLGetTheFloatDataLBVStyle(self, buffer, size):
+        start = self._script.pop(0)
+        if start is None:
+            return 0
+        data = np.zeros((16, 8), dtype=np.float32)
+        data[:, 0] = np.arange(start, start + 16)
+        data[:, 3] = 700 + data[:, 0] / 10
+        ctypes.memmove(buffer, data.tobytes(), data.nbytes)
+        return 1
+
+
+def record(path, script, times=None):
+    """Record a trace of a script, optionally with the host time of each call"""
+    recorder = TraceRecorder(FakeDLL(script), path)
+    buffer = (ctypes.c_float * (8 * 16))()
+    with pytest.MonkeyPatch.context() as patch:
+        if times is not None:
+            clock = iter(times)
+            patch.setattr(time, 'time', lambda: next(clock))
+        for _ in script:
+            recorder.fmDLLGetTheFloatDataLBVStyle(buffer, ctypes.sizeof(buffer))
+    recorder.close()
+
+
+@pytest.fixture
+def record_trace(tmp_path):
+    """Factory that records a script (see :py:func:`record`) to a new trace
+    file and gives its path"""
+    count = 0
+
+    def _record(script, times=None):
+        nonlocal count
+        count += 1
+        path = tmp_path / f'trace{count}.bin'
+        record(path, script, times)
+        return path
+
+    return _record
+
+
+def periodic(n_calls, period=3):
+    """Script without data every `period` calls, starting with such a call"""
+    script = []
+    counter = 0
+    for call in range(n_calls):
+        if call % period == 0:
+            script.append(None)
+        else:
+            script.append(counter)
+            counter += 16
+    return script
+
+
+@pytest.fixture
+def trace(record_trace):
+    """Trace of a first update without data (drop and read loops), then two
+    updates with 48 samples"""
+    return record_trace([None, None, 0, 16, 32, None, 48, 64, 80, None])
+
+
+@pytest.fixture
+def stream_trace(record_trace):
+    """Trace of 31 calls, with 320 samples and a call without data every 3
+    calls"""
+    return record_trace(periodic(31))
@@ -9,7 +9,6 @@ def main():
     logging.basicConfig(level=logging.DEBUG)
     parser = argparse.ArgumentParser()
     parser.add_argument('--dll-dir',
-                        required=True,
                         help='Path to directory containing AMTIUSBDevice.dll')
     parser.add_argument('--rate', default=500, type=int,
                         help='Sampling rate')
@@ -17,9 +16,14 @@ def main():
                         help='Device index')
     parser.add_argument('--time', default=10, type=int,
                         help='Acquire for this number of seconds, then exit')
+    parser.add_argument('--trace',
+                        help='Record the DLL data calls to this trace file')
+    parser.add_argument('--replay',
+                        help='Replay the DLL data calls from this trace file')
     args = parser.parse_args()
 
-    amti = ForceDriver(rate=args.rate, dll_dir=args.dll_dir, device_index=args.device)
+    amti = ForceDriver(rate=args.rate, dll_dir=args.dll_dir, device_index=args.device,
+                       trace=args.trace, replay=args.replay)
     tic = datetime.datetime.now()
     while True:
         amti.update()
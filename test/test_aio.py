@@ -0,0 +1,101 @@
+import asyncio
+
+import numpy as np
+import pytest
+from timeflux_amti.aio import ForceStream
+
+
+def test_stream(stream_trace):
+    """The stream gives all the recorded samples, in order"""
+
+    async def main():
+        chunks = []
+        async with ForceStream(rate=1000, replay=stream_trace, interval=0) as stream:
+            await stream.zero()
+            async for chunk in stream:
+                chunks.append(chunk)
+                if sum(len(c) for c in chunks) >= 320:
+                    break
+        return stream, chunks
+
+    stream, chunks = asyncio.run(main())
+    assert stream.diagnostics is not None
+    assert chunks[0].attrs['meta']['devices'] == stream.diagnostics['devices']
+    assert all(chunk.columns[0] == 'counter' for chunk in chunks)
+    counter = np.concatenate([chunk.counter.values for chunk in chunks])
+    assert np.array_equal(counter, np.arange(320))
+
+
+def test_drop_oldest(stream_trace):
+    """The oldest chunks are dropped when the consumer is too slow"""
+
+    async def main():
+        stream = ForceStream(rate=1000, replay=stream_trace, interval=0, maxsize=2)
+        await stream.start()
+        while stream.dropped < 3:
+            await asyncio.sleep(0.01)
+        await stream.stop()
+        return stream, [chunk async for chunk in stream]
+
+    stream, chunks = asyncio.run(main())
+    assert len(chunks) == 2
+    assert chunks[0].counter.values[0] > 0
+
+
+def test_block(stream_trace):
+    """No chunk is lost with the block policy"""
+
+    async def main():
+        stream = ForceStream(rate=1000, replay=stream_trace, interval=0, maxsize=1, policy='block')
+        await stream.start()
+        await asyncio.sleep(0.1)
+        chunks = []
+        async for chunk in stream:
+            chunks.append(chunk)
+            if sum(len(c) for c in chunks) >= 320:
+                break
+        await stream.stop()
+        return stream, chunks
+
+    stream, chunks = asyncio.run(main())
+    assert stream.dropped == 0
+    counter = np.concatenate([chunk.counter.values for chunk in chunks])
+    assert np.array_equal(counter, np.arange(320))
+
+
+def test_error_with_full_queue(stream_trace):
+    """An acquisition error is raised even when the queue was full"""
+
+    def unplugged():
+        raise RuntimeError('device unplugged')
+
+    async def main():
+        stream = ForceStream(rate=1000, replay=stream_trace, interval=0, maxsize=1)
+        await stream.start()
+        while not stream._queue.full():
+            await asyncio.sleep(0.01)
+        stream._driver.acquire = unplugged
+        while not stream._task.done():
+            await asyncio.sleep(0.01)
+        chunks = []
+        with pytest.raises(RuntimeError, match='device unplugged'):
+            async for chunk in stream:
+                chunks.append(chunk)
+        await stream.stop()
+        return chunks
+
+    assert len(asyncio.run(main())) == 1
+
+
+def test_quality(stream_trace):
+    """The quality bitmask and counts are given with the chunks"""
+
+    async def main():
+        async with ForceStream(rate=1000, replay=stream_trace, interval=0, quality=True) as stream:
+            async for chunk in stream:
+                return chunk
+
+    chunk = asyncio.run(main())
+    assert chunk.columns[-1] == 'quality'
+    assert np.all(chunk.quality == 0)
+    assert chunk.attrs['quality']['stuck_counter'] == 0
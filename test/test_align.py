@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+from timeflux_amti.nodes.align import Align
+
+
+START = pd.Timestamp('2020-01-01')
+
+
+def make_force(duration, rate=1000):
+    t = np.arange(int(duration * rate)) / rate
+    return pd.DataFrame({
+        'counter': np.arange(t.size, dtype=float),
+        'Fz': 700 + 10 * np.sin(2 * np.pi * t),
+        'trigger': (t >= duration / 2).astype(float),
+    }, index=START + pd.to_timedelta(t, unit='s'))
+
+
+def make_reference(duration, rate=300, seed=42):
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration * rate)) / rate + 0.0005
+    t += rng.uniform(0, 0.001, t.size)
+    return pd.DataFrame({'eeg': rng.standard_normal(t.size)},
+                        index=START + pd.to_timedelta(t, unit='s'))
+
+
+def run(node, force_chunks, reference_chunks):
+    outputs = []
+    for force, reference in zip(force_chunks, reference_chunks):
+        node.i.data = force
+        node.i_reference.data = reference
+        node.o.clear()
+        node.update()
+        if node.o.data is not None:
+            outputs.append(node.o.data)
+    return pd.concat(outputs)
+
+
+def split(data, n, offset=0):
+    """Split data in n chunks of the same duration"""
+    edges = START + pd.to_timedelta(offset + np.arange(n + 1) * 5 / n, unit='s')
+    edges = edges[:-1].append(pd.DatetimeIndex([START + pd.Timedelta(days=1)]))
+    return [data[(data.index >= a) & (data.index < b)] for a, b in zip(edges[:-1], edges[1:])]
+
+
+def test_align():
+    """Streaming alignment gives the same result as on the whole signals"""
+    force = make_force(5)
+    reference = make_reference(5)
+    node = Align(prefix='force_')
+    # The reference stream is late by a quarter of chunk
+    output = run(node, split(force, 50), split(reference, 50, offset=-0.025))
+    assert output.index.equals(reference.index[reference.index <= force.index[-1]])
+    assert np.array_equal(output.eeg.values, reference.eeg.values[:len(output)])
+
+    force_ns = force.index.values.astype(np.int64)
+    output_ns = output.index.values.astype(np.int64)
+    expected = np.interp(output_ns, force_ns, force.Fz.values)
+    assert np.allclose(output.force_Fz.values, expected)
+    # Hold columns take the nearest sample
+    nearest = np.abs(force_ns[np.newaxis, :] - output_ns[:, np.newaxis]).argmin(axis=1)
+    assert np.array_equal(output.force_counter.values, force.counter.values[nearest])
+    assert set(output.force_trigger.unique()) == {0, 1}
+
+
+def test_late_reference():
+    """A reference stream late by more than the maximum latency is aligned"""
+    force = make_force(5)
+    reference = make_reference(5)
+    node = Align(max_latency=0.5)
+    # The reference stream arrives 1 second (10 chunks) after the force stream
+    force_chunks = split(force, 50) + [force.iloc[:0]] * 10
+    reference_chunks = [reference.iloc[:0]] * 10 + split(reference, 50)
+    output = run(node, force_chunks, reference_chunks)
+    assert output.index.equals(reference.index[reference.index <= force.index[-1]])
+    expected = np.interp(output.index.values.astype(np.int64),
+                         force.index.values.astype(np.int64), force.Fz.values)
+    assert np.allclose(output.Fz.values, expected)
+
+
+def test_reference_only():
+    """Reference rows are emitted after the maximum latency without force data"""
+    reference = make_reference(5)
+    node = Align(columns=['Fz'], max_latency=0.5)
+    outputs = []
+    for chunk in split(reference, 50):
+        node.i_reference.data = chunk
+        node.o.clear()
+        node.update()
+        if node.o.data is not None:
+            outputs.append(node.o.data)
+    output = pd.concat(outputs)
+    released = reference.index <= reference.index[-1] - pd.Timedelta(0.5, 's')
+    assert output.index.equals(reference.index[released])
+    assert output.Fz.isna().all()
+    assert len(node._pending) <= 0.6 * 300
+
+
+def test_history_is_bounded():
+    """Only a short force history is kept, even when the reference is late"""
+    force = make_force(5)
+    reference = make_reference(5)
+    node = Align()
+    run(node, split(force, 50), split(reference, 50))
+    assert node._force_times.size <= 0.1 * 1000 + 20
+    node = Align(history=1)
+    for chunk in split(force, 50):
+        node.i.data = chunk
+        node.update()
+    assert node._force_times.size <= 1000 + 0.01 * 1000 + 2
+
+
+def test_max_latency():
+    """Reference rows are not delayed more than the maximum latency when the
+    force stream stalls"""
+    force = make_force(1)
+    reference = make_reference(2)
+    node = Align(max_latency=0.1, tolerance=0.01)
+    node.i.data = force
+    node.i_reference.data = reference
+    node.update()
+    output = node.o.data
+    last = reference.index[-1] - pd.Timedelta(0.1, unit='s')
+    assert output.index[-1] <= last
+    assert output.index[-1] >= last - pd.Timedelta(0.01, unit='s')
+    # Rows beyond the force data (and the tolerance) have no force values
+    late = output.index > force.index[-1] + pd.Timedelta(0.01, unit='s')
+    assert late.any()
+    assert output.Fz[late].isna().all()
+    assert output.Fz[~late].notna().all()
@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+import pytest
+from timeflux_amti.archive import ArchiveReader, ArchiveWriter
+
+
+RATE = 1000
+NAMES = ['counter', 'Fx', 'Fy', 'Fz', 'Mx', 'My', 'Mz', 'trigger']
+
+
+def make_data(n, start_counter=0, seed=42):
+    """Driver-like data of n samples, in float32"""
+    rng = np.random.default_rng(seed)
+    data = np.zeros((n, 8), dtype=np.float32)
+    data[:, 0] = (start_counter + np.arange(n)) % 2**24
+    data[:, 1:7] = rng.standard_normal((n, 6)) + 700
+    data[n // 2:, 7] = 1
+    timestamps = np.datetime64('2020-01-01T00:00:00', 'us') + \
+        (np.arange(n) * 1e6 / RATE).astype('timedelta64[us]')
+    return pd.DataFrame(data, index=timestamps, columns=NAMES)
+
+
+def write(path, data, chunk=123, **kwargs):
+    writer = ArchiveWriter(path, **kwargs)
+    for k in range(0, len(data), chunk):
+        writer.write(data.iloc[k:k + chunk])
+    writer.close()
+
+
+@pytest.mark.parametrize('codec', ['zlib', 'bz2', 'lzma'])
+def test_roundtrip(tmp_path, codec):
+    """Data is read back losslessly, in fixed-duration chunks"""
+    path = tmp_path / 'test.amti'
+    data = make_data(10500)
+    write(path, data, duration=2, codec=codec)
+    with ArchiveReader(path) as reader:
+        assert len(reader) == 6
+        assert all(reader.chunk(k).shape[0] == 2000 for k in range(5))
+        result = reader.read()
+    assert result.columns.tolist() == NAMES
+    assert np.array_equal(result.index.values, data.index.values)
+    assert np.array_equal(result.values, data.values)
+
+
+def test_seek(tmp_path):
+    """Seeks find the chunk of a timestamp or counter"""
+    path = tmp_path / 'test.amti'
+    data = make_data(10000)
+    write(path, data, duration=1)
+    with ArchiveReader(path) as reader:
+        assert reader.seek_time(data.index[4500]) == 4
+        assert reader.seek_counter(4500) == 4
+        result = reader.read(data.index[4500], data.index[6000])
+    assert np.array_equal(result.values, data.iloc[4500:6000].values)
+
+
+def test_counter_rollover(tmp_path):
+    """The counter is unwrapped after the rollover"""
+    path = tmp_path / 'test.amti'
+    data = make_data(3000, start_counter=2**24 - 1500)
+    write(path, data, duration=1)
+    with ArchiveReader(path) as reader:
+        result = reader.read()
+        assert np.array_equal(result.counter.values, 2**24 - 1500 + np.arange(3000))
+        assert reader.seek_counter(2**24 + 100) == 1
+
+
+def test_unclosed_archive(tmp_path):
+    """The index is rebuilt when the archive was not closed"""
+    path = tmp_path / 'test.amti'
+    data = make_data(5000)
+    write(path, data, duration=1)
+    # Remove the index and trailer
+    size = path.stat().st_size
+    with open(path, 'r+b') as fd:
+        fd.truncate(size - 5 * 32 - 16)
+    with ArchiveReader(path) as reader:
+        assert len(reader) == 5
+        assert np.array_equal(reader.read().values, data.values)
+
+
+def test_compression(tmp_path):
+    """The archive is smaller than the raw float32 data"""
+    path = tmp_path / 'test.amti'
+    data = make_data(20000)
+    write(path, data, duration=10)
+    assert path.stat().st_size < data.values.nbytes * 0.8
+
+
+def test_float64(tmp_path):
+    """Float64 data, such as processed data, is not truncated"""
+    path = tmp_path / 'test.amti'
+    data = make_data(3000).astype(np.float64)
+    data.iloc[:, 1:7] += 1e-9
+    write(path, data, duration=1)
+    with ArchiveReader(path) as reader:
+        assert reader.dtype == np.float64
+        result = reader.read()
+    assert np.array_equal(result.values, data.values)
+
+
+def test_type_change(tmp_path):
+    """Data that does not fit the type of the archive is rejected"""
+    writer = ArchiveWriter(tmp_path / 'test.amti')
+    data = make_data(100)
+    writer.write(data)
+    with pytest.raises(ValueError):
+        writer.write(data.astype(np.float64))
+    writer.close()
+
+
+def test_empty_archive(tmp_path):
+    """An archive is written even without data"""
+    path = tmp_path / 'test.amti'
+    ArchiveWriter(path).close()
+    with ArchiveReader(path) as reader:
+        assert len(reader) == 0
+        assert reader.read().empty
@@ -61,3 +61,20 @@ def test_overflow_detection(driver, caplog):
         driver.update()
         assert (logger_name, logging.WARNING, msg) in caplog.record_tuples, \
             'Counter overflow was undetected'
+
+
+def test_health(trace):
+    """Health changes are sent once, as diff-only metadata"""
+    # Poll explicitly: the interval is long enough for the thread to never poll
+    driver = ForceDriver(rate=1000, replay=trace, health_interval=3600)
+    driver.update()
+    driver._check_health()
+    driver.driver.fmDLLGetRunMode = lambda: 0
+    driver._check_health()
+    driver.update()
+    assert driver.o.meta['health'] == {'general': {'run_mode': 0}}
+    assert 'devices' in driver.o.meta
+    driver.o.clear()
+    driver.update()
+    assert 'health' not in driver.o.meta
+    driver.terminate()
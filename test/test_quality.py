@@ -0,0 +1,77 @@
+import numpy as np
+from timeflux_amti.nodes.driver import ForceDriver
+from timeflux_amti.quality import (QualityChecker, CLIPPING, NEAR_LIMIT, NAN,
+                                   STUCK_COUNTER)
+
+
+def make_data(counter, fz):
+    data = np.zeros((len(counter), 8))
+    data[:, 0] = counter
+    data[:, 3] = fz
+    return data
+
+
+def make_diagnostics():
+    """Diagnostics limits with (max, min) pairs and a capacity of 1000 N"""
+    return {
+        'devices': [{
+            'limits': {'mechanical_max_and_min': [(2000, -2000)] * 6},
+            'platform_calibration': {'capacity': [1000] * 6},
+        }],
+    }
+
+
+def test_flags():
+    """Each flag is set on the expected samples"""
+    checker = QualityChecker.from_diagnostics(make_diagnostics())
+    data = make_data([0, 1, 2, 2, 3, 4], [100, 950, 2000, 100, np.nan, -3000])
+    flags = checker.check(data)
+    assert flags.tolist() == [
+        0,
+        NEAR_LIMIT,
+        CLIPPING | NEAR_LIMIT,
+        STUCK_COUNTER,
+        NAN,
+        CLIPPING | NEAR_LIMIT,
+    ]
+    assert checker.counts == {'clipping': 2, 'near_limit': 3, 'nan': 1, 'stuck_counter': 1}
+
+
+def test_stuck_counter_across_chunks():
+    """A repeated sample is detected across chunk boundaries"""
+    checker = QualityChecker()
+    checker.check(make_data([0, 1, 2], 0))
+    flags = checker.check(make_data([2, 3, 1, 2], 0))
+    assert flags.tolist() == [STUCK_COUNTER, 0, STUCK_COUNTER, 0]
+    assert checker.counts['stuck_counter'] == 2
+
+
+def test_counter_rollover():
+    """The counter rollover is not a stuck counter"""
+    checker = QualityChecker()
+    flags = checker.check(make_data([2**24 - 2, 2**24 - 1, 0, 1], 0))
+    assert flags.tolist() == [0, 0, 0, 0]
+
+
+def test_unknown_limits():
+    """Zero-width limits, as given by an unconfigured device, are ignored"""
+    diagnostics = make_diagnostics()
+    diagnostics['devices'][0]['limits']['mechanical_max_and_min'] = [(0, 0)] * 6
+    diagnostics['devices'][0]['platform_calibration']['capacity'] = [0] * 6
+    checker = QualityChecker.from_diagnostics(diagnostics)
+    flags = checker.check(make_data([0, 1], [1e6, -1e6]))
+    assert flags.tolist() == [0, 0]
+
+
+def test_driver_quality(record_trace):
+    """The quality bitmask matches the output samples and counts the flags"""
+    path = record_trace([None, None, 0, 16, 16, None])
+    driver = ForceDriver(rate=1000, replay=path, quality=True)
+    driver.update()
+    driver.update()
+    assert driver.o_quality.data.index.equals(driver.o.data.index)
+    assert driver.o_quality.data.quality.tolist() == [0] * 32 + [STUCK_COUNTER] + [0] * 15
+    assert driver.o_quality.meta['quality'] == {
+        'clipping': 0, 'near_limit': 0, 'nan': 0, 'stuck_counter': 1,
+    }
+    driver.terminate()
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+from timeflux_amti.nodes.spectral import SpectralMonitor
+
+
+RATE = 1000
+
+
+def make_chunks(duration, chunk=100, mains=50, amplitude=1, noise=0.1, seed=42):
+    """Force data with mains interference and white noise, in chunks"""
+    rng = np.random.default_rng(seed)
+    n = int(duration * RATE)
+    t = np.arange(n) / RATE
+    data = pd.DataFrame({
+        'Fx': noise * rng.standard_normal(n),
+        'Fz': 700 + amplitude * np.sin(2 * np.pi * mains * t) + noise * rng.standard_normal(n),
+    }, index=pd.Timestamp('2020-01-01') + pd.to_timedelta(t, unit='s'))
+    return [data.iloc[k:k + chunk] for k in range(0, n, chunk)]
+
+
+def run(node, chunks):
+    outputs = []
+    for chunk in chunks:
+        node.i.data = chunk
+        node.o.clear()
+        node.update()
+        if node.o.ready():
+            outputs.append(node.o.data)
+    return outputs
+
+
+def test_mains_and_noise_floor():
+    """Mains power and noise floor match the synthetic signal"""
+    node = SpectralMonitor(rate=RATE, columns=['Fx', 'Fz'], interval=1)
+    outputs = run(node, make_chunks(20))
+    assert len(outputs) >= 18
+    last = outputs[-1].iloc[0]
+    # A sine of amplitude 1 has a power of 0.5
+    assert last['Fz_mains_50'] == pytest.approx(0.5, rel=0.1)
+    assert last['Fx_mains_50'] < 0.01
+    # White noise of standard deviation 0.1 has a one-sided density of 2 * 0.01 / rate
+    assert last['Fx_noise_floor'] == pytest.approx(2 * 0.01 / RATE, rel=0.2)
+    assert last['Fz_noise_floor'] == pytest.approx(2 * 0.01 / RATE, rel=0.2)
+
+
+def test_chunking_invariance():
+    """The estimate does not depend on how the input is chunked"""
+    a = SpectralMonitor(rate=RATE, columns=['Fx', 'Fz'])
+    b = SpectralMonitor(rate=RATE, columns=['Fx', 'Fz'])
+    run(a, make_chunks(5, chunk=16))
+    run(b, make_chunks(5, chunk=250))
+    assert np.allclose(a._psd, b._psd)
+
+
+def test_bands_and_nan():
+    """Additional bands are published and missing values are skipped"""
+    chunks = make_chunks(5)
+    chunks[10] = chunks[10].copy()
+    chunks[10].iloc[5, 0] = np.nan
+    node = SpectralMonitor(rate=RATE, columns=['Fx', 'Fz'], bands={'low': [0.5, 10]})
+    outputs = run(node, chunks)
+    assert 'Fx_low' in outputs[-1].columns
+    assert np.all(np.isfinite(outputs[-1].values))
@@ -0,0 +1,105 @@
+import ctypes
+import logging
+
+import numpy as np
+from timeflux_amti.nodes.driver import ForceDriver
+from timeflux_amti.trace import TraceReplayer, iter_trace
+
+
+def test_trace_roundtrip(trace):
+    """Recorded calls are read back identically"""
+    records = list(iter_trace(trace))
+    assert [retval for _, retval, _ in records] == [0, 0, 1, 1, 1, 0, 1, 1, 1, 0]
+    assert records[0][2].size == 0
+    assert np.array_equal(records[2][2].reshape(-1, 8)[:, 0], np.arange(16))
+
+
+def test_replayer_exhausted(trace):
+    """The replayer returns no data once the trace is exhausted"""
+    replayer = TraceReplayer(trace)
+    buffer = (ctypes.c_float * (8 * 16))()
+    results = [replayer.fmDLLGetTheFloatDataLBVStyle(buffer, ctypes.sizeof(buffer)) for _ in range(12)]
+    assert results[-2:] == [0, 0]
+    assert replayer.exhausted
+
+
+def test_driver_replay(trace):
+    """The driver gives the recorded data when replaying a trace"""
+    driver = ForceDriver(rate=1000, replay=trace)
+    driver.update()
+    assert driver.o.data is None
+    driver.update()
+    assert np.array_equal(driver.o.data.counter.values, np.arange(48))
+    driver.o.clear()
+    driver.update()
+    assert np.array_equal(driver.o.data.counter.values, np.arange(48, 96))
+    driver.terminate()
+
+
+def test_driver_replay_chunks(trace):
+    """Blocks are aligned on the counter and the remainder is carried over"""
+    driver = ForceDriver(rate=1000, replay=trace, chunk_size=40)
+    driver.update()
+    driver.update()
+    assert np.array_equal(driver.o.data.counter.values, np.arange(40))
+    driver.o.clear()
+    driver.update()
+    assert np.array_equal(driver.o.data.counter.values, np.arange(40, 80))
+    driver.terminate()
+
+
+def test_driver_replay_chunks_multiple(trace):
+    """All the complete blocks are emitted together"""
+    driver = ForceDriver(rate=1000, replay=trace, chunk_size=16)
+    driver.update()
+    driver.update()
+    assert np.array_equal(driver.o.data.counter.values, np.arange(48))
+    driver.terminate()
+
+
+def test_driver_replay_chunks_flush(record_trace):
+    """An incomplete block is flushed after the maximum latency, and the next
+    blocks complete it so that they stay aligned"""
+    script = [None, None, 0, 16, None, None, 32, 48, 64, None, 80, 96, 112, None]
+    times = [0, 0, 0, 0, 0, 0.1, 0.1, 0.1, 0.1, 0.1, 0.1, 0.1, 0.1, 0.1]
+    path = record_trace(script, times)
+    driver = ForceDriver(rate=1000, replay=path, chunk_size=40, max_latency=0.05)
+    driver.update()
+    driver.update()
+    assert driver.o.data is None
+    driver.update()
+    assert np.array_equal(driver.o.data.counter.values, np.arange(32))
+    driver.o.clear()
+    driver.update()
+    assert np.array_equal(driver.o.data.counter.values, np.arange(32, 80))
+    driver.o.clear()
+    driver.update()
+    assert np.array_equal(driver.o.data.counter.values, np.arange(80, 120))
+    driver.terminate()
+
+
+def test_driver_replay_chunks_realign(record_trace):
+    """Blocks are aligned again on the counter after a discontinuity"""
+    path = record_trace([None, None, 0, 16, 32, None, 100, 116, 132, 148, None])
+    driver = ForceDriver(rate=1000, replay=path, chunk_size=32)
+    driver.update()
+    driver.update()
+    assert np.array_equal(driver.o.data.counter.values, np.arange(32))
+    driver.o.clear()
+    driver.update()
+    # The incomplete block 32-47 and the samples 100-127 are dropped
+    assert np.array_equal(driver.o.data.counter.values, np.arange(128, 160))
+    driver.terminate()
+
+
+def test_driver_replay_overflow(record_trace, caplog):
+    """A counter jump in a trace is detected when replaying"""
+    path = record_trace([None, None, 0, 16, 512, None])
+    driver = ForceDriver(rate=1000, replay=path)
+    driver.update()
+    logger_name = 'timeflux.timeflux_amti.nodes.driver.ForceDriver'
+    msg = 'Discontinuity on sample count. Check your sampling rate and graph rate!'
+    with caplog.at_level(logging.WARNING, logger=logger_name):
+        driver.update()
+        assert (logger_name, logging.WARNING, msg) in caplog.record_tuples
+    driver.terminate()
@@ -0,0 +1,198 @@
+"""Asyncio streaming interface for the AMTI force platform
+
+Use this module to acquire force platform data from an asyncio application,
+without a Timeflux graph. For example:
+
+.. code-block:: python
+
+   import asyncio
+   from timeflux_amti.aio import ForceStream
+
+   async def main():
+       async with ForceStream(rate=1000) as stream:
+           await stream.zero()
+           async for chunk in stream:
+               print(chunk)
+
+   asyncio.run(main())
+
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import logging
+
+from timeflux_amti.nodes.driver import ForceDriver
+
+
+_STOP = object()
+
+
+class ForceStream:
+    """Asynchronous iterator over the data of the AMTI force platform.
+
+    This class runs a :py:class:`timeflux_amti.nodes.driver.ForceDriver` and
+    reuses its device initialization, sample reading, timestamps and
+    diagnostics, through the public methods of the driver (see
+    :py:meth:`timeflux_amti.nodes.driver.ForceDriver.acquire`). All the DLL
+    calls (initialization, reading, zeroing and release) run on a dedicated
+    worker thread, so that they never block the event loop and they are
+    serialized with respect to each other.
+
+    Each chunk is a pandas.DataFrame with the same columns as the output of
+    the driver. When the driver has metadata to send (the diagnostics on the
+    first chunk, or health changes), it is found in ``chunk.attrs['meta']``.
+    When the driver checks the quality of the data (``quality=True``), the
+    chunks have an additional ``quality`` column with the bitmask of the
+    quality flags, and ``chunk.attrs['quality']`` holds the running count of
+    samples with each flag.
+
+    The chunks are buffered in a bounded queue. When the consumer is too
+    slow and the queue is full, the ``'drop-oldest'`` policy discards the
+    oldest chunk, while the ``'block'`` policy pauses the acquisition until
+    there is some room in the queue. Note that, with the ``'block'`` policy, a
+    long pause may overflow the DLL buffer (which will show as a warning on
+    the logs).
+
+    Args:
+        interval (float): Time, in seconds, between two reads of the DLL
+            buffer. Defaults to 0.05.
+        maxsize (int): Maximum number of chunks in the queue. Defaults to 100.
+        policy (str): Policy when the queue is full, either ``'drop-oldest'``
+            or ``'block'``. Defaults to ``'drop-oldest'``.
+        **kwargs: Arguments of
+            :py:class:`timeflux_amti.nodes.driver.ForceDriver`.
+
+    Attributes:
+        diagnostics (dict): Diagnostics of the device, available once the
+            stream is started.
+        dropped (int): Number of chunks discarded by the ``'drop-oldest'``
+            policy.
+
+    """
+
+    POLICIES = ('drop-oldest', 'block')
+    """Supported policies when the queue is full."""
+
+    def __init__(self, interval=0.05, maxsize=100, policy='drop-oldest', **kwargs):
+        if policy not in ForceStream.POLICIES:
+            raise ValueError('Invalid policy')
+        self.logger = logging.getLogger('timeflux.' + __name__ + '.' + type(self).__name__)
+        self._interval = interval
+        self._maxsize = maxsize
+        self._policy = policy
+        self._kwargs = kwargs
+        self._executor = None
+        self._driver = None
+        self._queue = None
+        self._task = None
+        self._stop_pending = False
+        self._error = None
+        self.diagnostics = None
+        self.dropped = 0
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.stop()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._queue is None or (self._stop_pending and self._queue.empty()):
+            self._end()
+        chunk = await self._queue.get()
+        if chunk is _STOP:
+            self._end()
+        return chunk
+
+    async def start(self):
+        """Initialize the device and start the acquisition."""
+        loop = asyncio.get_running_loop()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='ForceStream')
+        try:
+            self._driver = await loop.run_in_executor(self._executor,
+                                                      functools.partial(ForceDriver, **self._kwargs))
+        except Exception:
+            self._executor.shutdown()
+            raise
+        self.diagnostics = self._driver.diagnostics
+        self._queue = asyncio.Queue(maxsize=self._maxsize)
+        self._stop_pending = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the acquisition and release the device.
+
+        The chunks already in the queue can still be iterated, then the
+        iteration stops.
+
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self._driver.terminate)
+        finally:
+            self._executor.shutdown()
+            self._close_queue()
+
+    async def zero(self):
+        """Zero the device, setting the tare."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._driver.zero)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                chunk, meta = await loop.run_in_executor(self._executor, self._driver.acquire)
+                if chunk is not None:
+                    quality = self._driver.quality_counts
+                    if quality is not None:
+                        chunk.attrs['quality'] = quality
+                    if meta:
+                        chunk.attrs['meta'] = meta
+                    await self._put(chunk)
+                await asyncio.sleep(self._interval)
+        except asyncio.CancelledError:
+            raise
+        except Exception as ex:
+            self.logger.error('Acquisition failed', exc_info=True)
+            self._error = ex
+            self._close_queue()
+
+    async def _put(self, chunk):
+        if self._policy == 'block':
+            await self._queue.put(chunk)
+            return
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+            self.logger.warning('Stream queue is full, dropped the oldest chunk')
+        self._queue.put_nowait(chunk)
+
+    def _end(self):
+        """Stop the iteration, raising the acquisition error if any"""
+        self._stop_pending = True
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+        raise StopAsyncIteration
+
+    def _close_queue(self):
+        try:
+            self._queue.put_nowait(_STOP)
+        except asyncio.QueueFull:
+            # The iteration stops once the queue is empty
+            self._stop_pending = True
@@ -0,0 +1,433 @@
+"""Compressed archive format for long force platform recordings
+
+An archive stores the output of
+:py:class:`timeflux_amti.nodes.driver.ForceDriver` in chunks of a fixed
+duration. Each chunk is encoded to take advantage of the structure of the data
+and then compressed losslessly:
+
+* The timestamps and the sample counter are delta encoded, then run-length
+  encoded. Since both increase regularly, a chunk usually reduces to a handful
+  of runs.
+* The trigger column is run-length encoded.
+* The force and moment columns are byte-shuffled (all the first bytes of the
+  values, then all the second bytes, and so on) so that the compressor finds
+  the redundancy of the exponent bytes.
+
+The trigger, force and moment columns are stored with the floating point type
+of the first data written: float32 for the output of the driver, and float64
+for processed data such as the output of
+:py:class:`timeflux_amti.nodes.align.Align`, so that no precision is lost.
+
+The file is a header (the magic bytes ``AMTIARC``, a format version, the
+compression codec, the column names and their type), followed by the chunks. When the
+archive is closed, an index of the chunks by timestamp and counter is appended
+at the end of the file, so that :py:class:`ArchiveReader` finds a chunk with a
+binary search. If the archive was not closed properly, the reader rebuilds the
+index by scanning the chunk headers.
+
+The counter of the AMTI device rolls over at 2^24. The index keeps an
+unwrapped counter, which is the counter plus 2^24 times the number of
+rollovers since the first sample of the archive.
+
+"""
+
+import bz2
+import json
+import lzma
+import queue
+import struct
+import threading
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from timeflux_amti.exceptions import TimefluxAmtiException
+
+
+MAGIC = b'AMTIARC'
+VERSION = 2
+CODECS = {
+    'zlib': (1, zlib.compress, zlib.decompress),
+    'bz2': (2, bz2.compress, bz2.decompress),
+    'lzma': (3, lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+}
+"""Supported compression codecs: identifier, compress and decompress functions"""
+
+_COUNTER_PERIOD = 2**24
+_HEADER = struct.Struct('<7sBBH')  # magic, version, codec, columns description length
+_CHUNK = struct.Struct('<4sqqqII')  # magic, first ts, last ts, first counter, samples, size
+_CHUNK_MAGIC = b'CHNK'
+_INDEX = np.dtype([('first_ts', '<i8'), ('last_ts', '<i8'), ('counter', '<i8'), ('offset', '<i8')])
+_TRAILER = struct.Struct('<qI4s')  # index offset, number of chunks, magic
+_TRAILER_MAGIC = b'AIDX'
+
+
+def _rle_encode(values):
+    """Run-length encode a 1D array into (values, counts)"""
+    if values.size == 0:
+        return values, np.empty(0, dtype='<u4')
+    starts = np.concatenate(([0], np.flatnonzero(values[1:] != values[:-1]) + 1))
+    counts = np.diff(np.append(starts, values.size))
+    return values[starts], counts.astype('<u4')
+
+
+def _rle_decode(values, counts):
+    return np.repeat(values, counts)
+
+
+def _pack(*arrays):
+    """Concatenate arrays, each prefixed by its size in bytes"""
+    parts = []
+    for array in arrays:
+        data = np.ascontiguousarray(array).tobytes()
+        parts.append(struct.pack('<I', len(data)))
+        parts.append(data)
+    return b''.join(parts)
+
+
+def _unpack(payload, dtypes):
+    arrays = []
+    offset = 0
+    for dtype in dtypes:
+        (size,) = struct.unpack_from('<I', payload, offset)
+        offset += 4
+        arrays.append(np.frombuffer(payload, dtype=dtype, count=size // np.dtype(dtype).itemsize,
+                                    offset=offset))
+        offset += size
+    return arrays
+
+
+def _shuffle(values, dtype):
+    """Byte-shuffle an array of values of a given type"""
+    dtype = np.dtype(dtype)
+    return values.astype(dtype).view(np.uint8).reshape(-1, dtype.itemsize).T
+
+
+def _unshuffle(data, dtype):
+    dtype = np.dtype(dtype)
+    return np.ascontiguousarray(data.reshape(dtype.itemsize, -1).T).view(dtype).ravel()
+
+
+def _float_type(dtypes):
+    """Little-endian floating point type that holds all the given types"""
+    dtype = np.result_type(np.float32, *dtypes)
+    if dtype.kind != 'f':
+        dtype = np.dtype(np.float64)
+    return dtype.newbyteorder('<')
+
+
+def encode_chunk(timestamps, counter, trigger, values, dtype='<f4'):
+    """Encode the columns of a chunk, before compression.
+
+    Args:
+        timestamps (numpy.ndarray): int64 timestamps, in microseconds.
+        counter (numpy.ndarray): Sample counter.
+        trigger (numpy.ndarray): Trigger column.
+        values (numpy.ndarray): 2D array of the other columns.
+        dtype (str): Floating point type of `trigger` and `values`. Defaults
+            to ``'<f4'``.
+
+    Returns:
+        bytes: The encoded chunk.
+
+    """
+    timestamps = timestamps.astype('<i8')
+    counter = counter.astype('<i8')
+    ts_values, ts_counts = _rle_encode(np.diff(timestamps, prepend=timestamps[:1]))
+    counter_values, counter_counts = _rle_encode(np.diff(counter, prepend=counter[:1]))
+    trigger_values, trigger_counts = _rle_encode(trigger.astype(dtype))
+    return _pack(
+        timestamps[:1], ts_values, ts_counts,
+        counter[:1], counter_values, counter_counts,
+        trigger_values, trigger_counts,
+        _shuffle(values.T.ravel(), dtype),
+    )
+
+
+def decode_chunk(payload, n_values, dtype='<f4'):
+    """Decode a chunk encoded by :py:func:`encode_chunk`.
+
+    Args:
+        payload (bytes): The encoded chunk.
+        n_values (int): Number of columns of `values`.
+        dtype (str): Floating point type of `trigger` and `values`. Defaults
+            to ``'<f4'``.
+
+    Returns:
+        tuple: A ``(timestamps, counter, trigger, values)`` tuple.
+
+    """
+    (ts_first, ts_values, ts_counts,
+     counter_first, counter_values, counter_counts,
+     trigger_values, trigger_counts, shuffled) = _unpack(
+        payload, ['<i8', '<i8', '<u4', '<i8', '<i8', '<u4', dtype, '<u4', np.uint8]
+    )
+    timestamps = ts_first[0] + np.cumsum(_rle_decode(ts_values, ts_counts))
+    counter = counter_first[0] + np.cumsum(_rle_decode(counter_values, counter_counts))
+    trigger = _rle_decode(trigger_values, trigger_counts)
+    values = _unshuffle(shuffled, dtype).reshape(n_values, -1).T
+    return timestamps, counter, trigger, values
+
+
+class ArchiveWriter:
+    """Write force platform data to an archive.
+
+    The data is cut into chunks of `duration` seconds by the caller thread,
+    but the encoding, compression and writing happen on a worker thread, so
+    that :py:meth:`write` never blocks on the compression or on the disk.
+
+    Args:
+        path (str): Path of the archive file. It is overwritten if it exists.
+        duration (float): Duration of each chunk, in seconds. Defaults to 10.
+        codec (str): Compression codec, one of :py:data:`CODECS`. Defaults to
+            ``'zlib'``.
+        level (int): Compression level. Defaults to 6.
+
+    """
+
+    def __init__(self, path, duration=10, codec='zlib', level=6):
+        if codec not in CODECS:
+            raise ValueError('Invalid codec')
+        self._path = path
+        self._duration = int(duration * 1e6)
+        self._codec = codec
+        self._level = level
+        self._names = None
+        self._dtype = None
+        self._pending = []
+        self._chunk_start = None
+        self._previous_counter = None
+        self._wraps = 0
+        self._fd = None
+        self._index = []
+        self._error = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._work, name='ArchiveWriter', daemon=True)
+        self._thread.start()
+
+    def write(self, data):
+        """Append data to the archive.
+
+        Args:
+            data (pandas.DataFrame): Data with a datetime index, and the
+                ``counter`` and ``trigger`` columns.
+
+        Raises:
+            ValueError: When the columns do not fit the type of the archive,
+                which is set by the first data written.
+
+        """
+        self._check()
+        if data is None or data.empty:
+            return
+        dtype = _float_type(data.drop(columns='counter').dtypes)
+        if self._names is None:
+            self._names = [name for name in data.columns
+                           if name not in ('counter', 'trigger')]
+            self._dtype = dtype
+            self._queue.put(('header', (self._names, self._dtype)))
+        elif dtype != self._dtype:
+            raise ValueError(f'Data of type {dtype} cannot be written losslessly '
+                             f'to an archive of type {self._dtype}')
+        self._pending.append(data)
+
+        # Emit all the complete chunks. The chunk boundaries are multiples of
+        # the duration since the first timestamp
+        timestamps = data.index.values.astype('datetime64[us]').astype(np.int64)
+        if self._chunk_start is None:
+            self._chunk_start = timestamps[0]
+        while timestamps[-1] >= self._chunk_start + self._duration:
+            pending = pd.concat(self._pending) if len(self._pending) > 1 else self._pending[0]
+            pending_ts = pending.index.values.astype('datetime64[us]').astype(np.int64)
+            # Skip the periods without data
+            self._chunk_start += (pending_ts[0] - self._chunk_start) // self._duration * self._duration
+            split = np.searchsorted(pending_ts, self._chunk_start + self._duration)
+            self._chunk_start += self._duration
+            self._pending = [pending.iloc[split:]]
+            if split > 0:
+                self._enqueue(pending.iloc[:split])
+
+    def close(self):
+        """Write the pending data and the index, then close the archive.
+
+        An archive without any data is still written, with no columns and no
+        chunks.
+
+        """
+        if self._names is None:
+            self._names = []
+            self._dtype = _float_type([])
+            self._queue.put(('header', (self._names, self._dtype)))
+        if self._pending:
+            pending = pd.concat(self._pending)
+            self._pending = []
+            if not pending.empty:
+                self._enqueue(pending)
+        self._queue.put(('close', None))
+        self._thread.join()
+        self._check()
+
+    def _enqueue(self, data):
+        counter = data['counter'].values.astype(np.int64)
+        # Unwrap the counter rollovers
+        previous = counter[0] if self._previous_counter is None else self._previous_counter
+        wraps = self._wraps + np.cumsum(np.diff(counter, prepend=previous) < -_COUNTER_PERIOD // 2)
+        self._wraps = int(wraps[-1])
+        self._previous_counter = counter[-1]
+        self._queue.put(('chunk', (
+            data.index.values.astype('datetime64[us]').astype(np.int64),
+            counter + wraps * _COUNTER_PERIOD,
+            data['trigger'].values,
+            data[self._names].values,
+        )))
+
+    def _check(self):
+        if self._error is not None:
+            raise TimefluxAmtiException('Archive writer failed') from self._error
+
+    def _work(self):
+        codec_id, compress, _ = CODECS[self._codec]
+        while True:
+            command, payload = self._queue.get()
+            try:
+                if command == 'header':
+                    names, dtype = payload
+                    columns = json.dumps({'names': names, 'dtype': dtype.str}).encode('utf-8')
+                    self._fd = open(self._path, 'wb')
+                    self._fd.write(_HEADER.pack(MAGIC, VERSION, codec_id, len(columns)))
+                    self._fd.write(columns)
+                elif command == 'chunk':
+                    timestamps, counter, trigger, values = payload
+                    data = compress(encode_chunk(timestamps, counter, trigger, values, self._dtype),
+                                    self._level)
+                    offset = self._fd.tell()
+                    self._fd.write(_CHUNK.pack(_CHUNK_MAGIC, timestamps[0], timestamps[-1],
+                                               counter[0], timestamps.size, len(data)))
+                    self._fd.write(data)
+                    self._index.append((timestamps[0], timestamps[-1], counter[0], offset))
+                elif command == 'close':
+                    if self._fd is not None:
+                        offset = self._fd.tell()
+                        self._fd.write(np.array(self._index, dtype=_INDEX).tobytes())
+                        self._fd.write(_TRAILER.pack(offset, len(self._index), _TRAILER_MAGIC))
+                        self._fd.close()
+                    return
+            except Exception as ex:
+                self._error = ex
+                if command == 'close':
+                    return
+
+
+class ArchiveReader:
+    """Read an archive written by :py:class:`ArchiveWriter`.
+
+    Args:
+        path (str): Path of the archive file.
+
+    Attributes:
+        index (numpy.ndarray): Structured array with the first and last
+            timestamps (int64, in microseconds), the first unwrapped counter
+            and the file offset of each chunk.
+        names (list): Names of the force and moment columns.
+        dtype (numpy.dtype): Floating point type of the force, moment and
+            trigger columns.
+
+    """
+
+    def __init__(self, path):
+        self._fd = open(path, 'rb')
+        header = self._fd.read(_HEADER.size)
+        if len(header) != _HEADER.size:
+            raise TimefluxAmtiException(f'Invalid archive file {path}')
+        magic, version, codec_id, columns_size = _HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise TimefluxAmtiException(f'Invalid archive file {path}')
+        self._decompress = {codec[0]: codec[2] for codec in CODECS.values()}[codec_id]
+        columns = json.loads(self._fd.read(columns_size).decode('utf-8'))
+        self.names = columns['names']
+        self.dtype = np.dtype(columns['dtype'])
+        self._data_start = self._fd.tell()
+        self.index = self._read_index()
+
+    def __len__(self):
+        return self.index.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._fd.close()
+
+    def chunk(self, k):
+        """Read the `k`-th chunk.
+
+        Returns:
+            pandas.DataFrame: The chunk data, with the unwrapped counter.
+
+        """
+        self._fd.seek(self.index['offset'][k])
+        _, _, _, _, _, size = _CHUNK.unpack(self._fd.read(_CHUNK.size))
+        payload = self._decompress(self._fd.read(size))
+        timestamps, counter, trigger, values = decode_chunk(payload, len(self.names), self.dtype)
+        data = pd.DataFrame(values, index=timestamps.astype('datetime64[us]'), columns=self.names)
+        data.insert(0, 'counter', counter)
+        data['trigger'] = trigger
+        return data
+
+    def seek_time(self, timestamp):
+        """Index of the chunk that contains a timestamp, or would contain it"""
+        timestamp = np.datetime64(timestamp, 'us').astype(np.int64)
+        return int(min(np.searchsorted(self.index['last_ts'], timestamp), max(len(self) - 1, 0)))
+
+    def seek_counter(self, counter):
+        """Index of the chunk that contains an unwrapped counter value"""
+        return int(max(np.searchsorted(self.index['counter'], counter, side='right') - 1, 0))
+
+    def read(self, start=None, stop=None):
+        """Read the data between two timestamps.
+
+        Args:
+            start: First timestamp, included. Defaults to the beginning.
+            stop: Last timestamp, excluded. Defaults to the end.
+
+        Returns:
+            pandas.DataFrame: The data, with the unwrapped counter.
+
+        """
+        first = 0 if start is None else self.seek_time(start)
+        last = len(self) if stop is None else self.seek_time(stop) + 1
+        chunks = [self.chunk(k) for k in range(first, last)]
+        if not chunks:
+            return pd.DataFrame(columns=['counter'] + self.names + ['trigger'])
+        data = pd.concat(chunks)
+        if start is not None:
+            data = data[data.index >= np.datetime64(start, 'us')]
+        if stop is not None:
+            data = data[data.index < np.datetime64(stop, 'us')]
+        return data
+
+    def _read_index(self):
+        self._fd.seek(0, 2)
+        end = self._fd.tell()
+        if end - self._data_start >= _TRAILER.size:
+            self._fd.seek(end - _TRAILER.size)
+            offset, n_chunks, magic = _TRAILER.unpack(self._fd.read(_TRAILER.size))
+            if magic == _TRAILER_MAGIC and offset + n_chunks * _INDEX.itemsize + _TRAILER.size == end:
+                self._fd.seek(offset)
+                return np.frombuffer(self._fd.read(n_chunks * _INDEX.itemsize), dtype=_INDEX)
+
+        # No index: the archive was not closed, scan the chunks
+        index = []
+        offset = self._data_start
+        while offset + _CHUNK.size <= end:
+            self._fd.seek(offset)
+            magic, first_ts, last_ts, counter, _, size = _CHUNK.unpack(self._fd.read(_CHUNK.size))
+            if magic != _CHUNK_MAGIC or offset + _CHUNK.size + size > end:
+                break
+            index.append((first_ts, last_ts, counter, offset))
+            offset += _CHUNK.size + size
+        return np.array(index, dtype=_INDEX)
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+"""Timeflux AMTI alignment node
+
+Use this node to resample the force platform data on the timestamps of
+another stream, such as EEG or motion capture.
+"""
+
+import numpy as np
+import pandas as pd
+from timeflux.core.node import Node
+
+
+class Align(Node):
+    """ Streaming alignment of force platform data on another stream.
+
+    This node resamples the force data received on its default input at the
+    timestamps of the rows received on the `i_reference` input, and outputs
+    the reference rows joined with the resampled force columns. The
+    processing is incremental: each reference row is handled once, and only a
+    short history of force samples is kept between updates.
+
+    Each reference row is resampled with the force samples right before and
+    right after its timestamp: linearly for most columns, and with the nearest
+    sample for the `hold` columns (such as the counter and the trigger, which
+    make no sense interpolated). A reference row that is not yet followed by
+    a force sample waits for the next updates, but at most `max_latency`
+    seconds (in the time of the reference stream, that is, until a reference
+    row `max_latency` seconds newer is received). After that, it takes the
+    nearest force sample. Neighbouring force samples further than `tolerance`
+    seconds are never used; when there is none, the force columns are NaN.
+    This includes the reference rows received before any force data, which
+    have no force column at all when `columns` is not set.
+
+    The force samples are kept until the reference stream reaches them, so
+    that a reference stream that arrives later than the force stream (such as
+    an LSL stream with its own buffering) is still aligned. This history is
+    bounded to the last `history` seconds of force data: a reference stream
+    that is late by more than that gets NaN force columns.
+
+    Args:
+        columns (list): Names of the force columns to resample. Defaults to
+            all the columns of the force input.
+        hold (list): Names of the force columns resampled with the nearest
+            sample instead of linearly. Defaults to ``['counter', 'trigger']``.
+        prefix (str): Prefix added to the force column names in the output,
+            to avoid clashes with the reference columns. Defaults to ``''``.
+        tolerance (float): Maximum distance, in seconds, between a reference
+            timestamp and the force samples used to resample it. Defaults to
+            0.01.
+        max_latency (float): Maximum time, in seconds, that a reference row
+            waits for the force samples that follow it. Defaults to 0.5.
+        history (float): Maximum duration, in seconds, of the force history
+            kept for a late reference stream. Defaults to 10.
+
+    Attributes:
+        i (Port): Default input, expects a pandas.DataFrame such as the output
+            of :py:class:`timeflux_amti.nodes.driver.ForceDriver`.
+        i_reference (Port): Reference input, expects a pandas.DataFrame whose
+            index gives the target timestamps.
+        o (Port): Default output, provides a pandas.DataFrame with the
+            reference rows and the resampled force columns.
+
+    Examples:
+
+        The following YAML pipeline aligns the force data on an EEG stream
+        received from LSL:
+
+        .. code-block:: yaml
+
+           graphs:
+              - nodes:
+                - id: driver
+                  module: timeflux_amti.nodes.driver
+                  class: ForceDriver
+                  params:
+                    rate: 1000
+
+                - id: eeg
+                  module: timeflux.nodes.lsl
+                  class: Receive
+                  params:
+                    prop: type
+                    value: EEG
+
+                - id: align
+                  module: timeflux_amti.nodes.align
+                  class: Align
+                  params:
+                    prefix: force_
+
+                - id: display
+                  module: timeflux.nodes.debug
+                  class: Display
+
+                rate: 20
+
+                edges:
+                  - source: driver
+                    target: align
+                  - source: eeg
+                    target: align:reference
+                  - source: align
+                    target: display
+
+    """
+
+    def __init__(self, columns=None, hold=('counter', 'trigger'), prefix='', tolerance=0.01, max_latency=0.5,
+                 history=10):
+        super().__init__()
+        self._columns = None if columns is None else list(columns)
+        self._hold = list(hold)
+        self._prefix = prefix
+        self._tolerance = int(tolerance * 1e9)
+        self._max_latency = int(max_latency * 1e9)
+        self._history = int(history * 1e9)
+        self._linear = None
+        self._force_times = np.empty(0, dtype=np.int64)
+        self._force_values = None
+        self._pending = None
+        self._newest_force = None
+        self._newest_reference = None
+
+    def update(self):
+        if self.i.ready():
+            force = self.i.data
+            if self._columns is None:
+                self._columns = list(force.columns)
+            self._init_history()
+            times = _nanoseconds(force.index)
+            self._force_times = np.concatenate((self._force_times, times))
+            self._force_values = np.vstack((self._force_values, force[self._columns].values))
+            self._newest_force = times[-1]
+
+        if self.i_reference.ready():
+            reference = self.i_reference.data
+            self._pending = reference if self._pending is None else pd.concat((self._pending, reference))
+            self._newest_reference = _nanoseconds(reference.index[-1:])[0]
+
+        if self._pending is None or self._pending.empty:
+            self._trim(None)
+            return
+
+        # Emit the reference rows that are followed by a force sample, or that
+        # waited for too long, even when no force data was received yet
+        times = _nanoseconds(self._pending.index)
+        last_force = self._force_times[-1] if self._force_times.size else np.iinfo(np.int64).min
+        ready = (times <= last_force) | (times <= self._newest_reference - self._max_latency)
+        n_ready = np.argmin(ready) if not ready.all() else ready.size
+        if n_ready > 0:
+            output = self._pending.iloc[:n_ready].copy()
+            if self._columns is not None:
+                self._init_history()
+                names = [self._prefix + column for column in self._columns]
+                output[names] = self._resample(times[:n_ready])
+            self.o.data = output
+            self._pending = self._pending.iloc[n_ready:]
+        self._trim(times[n_ready] if n_ready < times.size else None)
+
+    def _init_history(self):
+        """Allocate the force history, once the force columns are known"""
+        if self._force_values is None:
+            self._linear = np.array([column not in self._hold for column in self._columns])
+            self._force_values = np.empty((0, len(self._columns)))
+
+    def _resample(self, times):
+        """Resample the force history at the given timestamps (vectorized)"""
+        force_times, force_values = self._force_times, self._force_values
+        values = np.full((times.size, force_values.shape[1]), np.nan)
+        n = force_times.size
+        if n == 0:
+            return values
+
+        right = np.searchsorted(force_times, times, side='right')
+        left = np.clip(right - 1, 0, n - 1)
+        right = np.clip(right, 0, n - 1)
+        distance_left = np.where(force_times[left] <= times, times - force_times[left], np.inf)
+        distance_right = np.where(force_times[right] > times, force_times[right] - times, np.inf)
+
+        # Nearest sample, for the hold columns and when there is a single neighbour
+        nearest = np.where(distance_left <= distance_right, left, right)
+        valid = np.minimum(distance_left, distance_right) <= self._tolerance
+        values[valid] = force_values[nearest[valid]]
+
+        # Linear interpolation when both neighbours are close enough
+        both = (distance_left <= self._tolerance) & (distance_right <= self._tolerance)
+        if np.any(both):
+            left, right = left[both], right[both]
+            weight = ((times[both] - force_times[left]) / (force_times[right] - force_times[left]))[:, np.newaxis]
+            linear = force_values[left] + weight * (force_values[right] - force_values[left])
+            values[np.ix_(both, self._linear)] = linear[:, self._linear]
+        return values
+
+    def _trim(self, first_pending):
+        """Drop the force samples that will not be needed anymore"""
+        if self._force_times.size == 0:
+            return
+        # The next reference rows are not older than the first pending row, or
+        # than the newest reference row when there is no pending row
+        low = self._newest_force - self._history
+        expected = first_pending if first_pending is not None else self._newest_reference
+        if expected is not None:
+            low = max(low, expected)
+        # Keep one sample before the lower bound, as left neighbour
+        start = max(np.searchsorted(self._force_times, low - self._tolerance) - 1, 0)
+        if start > 0:
+            self._force_times = self._force_times[start:]
+            self._force_values = self._force_values[start:]
+
+
+def _nanoseconds(index):
+    return np.asarray(index.values).astype('datetime64[ns]').astype(np.int64)
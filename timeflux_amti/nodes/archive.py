@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+"""Timeflux AMTI archive node
+
+Use this node to save long force platform recordings in a compact format.
+"""
+
+import json
+import os
+import time
+
+from timeflux.core.node import Node
+
+from timeflux_amti.archive import ArchiveWriter
+
+
+class Save(Node):
+    """ Save the AMTI force platform data to a compressed archive.
+
+    This node is an alternative to :py:class:`timeflux.nodes.hdf5.Save` for
+    long recordings. It writes the output of
+    :py:class:`timeflux_amti.nodes.driver.ForceDriver` to an archive file, as
+    described in :py:mod:`timeflux_amti.archive`. The compression runs on a
+    worker thread, so that the graph is never blocked by it. The metadata of
+    the input, such as the driver diagnostics, is saved to a JSON file with
+    the same name as the archive and a ``.json`` extension.
+
+    Use :py:class:`timeflux_amti.archive.ArchiveReader` to read the archive.
+
+    Args:
+        filename (str): Name of the archive file, inside `path`. Defaults to a
+            name generated from the current date and time.
+        path (str): Directory where the archive is written. Defaults to
+            ``/tmp``.
+        duration (float): Duration of each chunk, in seconds. Defaults to 10.
+        codec (str): Compression codec, one of ``'zlib'``, ``'bz2'`` or
+            ``'lzma'``. Defaults to ``'zlib'``.
+        level (int): Compression level. Defaults to 6.
+
+    Attributes:
+        i (Port): Default input, expects a pandas.DataFrame such as the output
+            of :py:class:`timeflux_amti.nodes.driver.ForceDriver`.
+
+    Examples:
+
+        The following YAML pipeline acquires at 1000 Hz and saves the data in
+        chunks of one minute:
+
+        .. code-block:: yaml
+
+           graphs:
+              - nodes:
+                - id: driver
+                  module: timeflux_amti.nodes.driver
+                  class: ForceDriver
+                  params:
+                    rate: 1000
+
+                - id: archive
+                  module: timeflux_amti.nodes.archive
+                  class: Save
+                  params:
+                    path: data
+                    duration: 60
+
+                rate: 20
+
+                edges:
+                  - source: driver
+                    target: archive
+
+    """
+
+    def __init__(self, filename=None, path='/tmp', duration=10, codec='zlib', level=6):
+        super().__init__()
+        os.makedirs(path, exist_ok=True)
+        if filename is None:
+            filename = time.strftime('%Y%m%d-%H%M%S.amti', time.gmtime())
+        self._filename = os.path.join(path, filename)
+        self.logger.info('Saving to %s', self._filename)
+        self._writer = ArchiveWriter(self._filename, duration=duration, codec=codec, level=level)
+        self._meta = {}
+
+    def update(self):
+        if self.i.ready():
+            self._writer.write(self.i.data)
+        if self.i.meta:
+            self._meta.update(self.i.meta)
+
+    def terminate(self):
+        self._writer.close()
+        if self._meta:
+            with open(os.path.splitext(self._filename)[0] + '.json', 'w') as fd:
+                json.dump(self._meta, fd, indent=2, default=str)
@@ -9,14 +9,18 @@ import ctypes
 import json
 import pathlib
 import sys
+import threading
 import time
 import warnings
 
 from timeflux.core.node import Node
 import numpy as np
+import pandas as pd
 
 import timeflux_amti
 from timeflux_amti.exceptions import TimefluxAmtiException
+from timeflux_amti.quality import QualityChecker
+from timeflux_amti.trace import TraceRecorder, TraceReplayer
 
 
 _default_dll_dir = (
@@ -63,11 +67,52 @@ class ForceDriver(Node):
         zero_trigger (str): Name of a stimulation event that, when received,
             will force the device to zero itself, setting the tare value of
             the force platform.
+        event_label (str): Column of the input events where the
+            `zero_trigger` is searched. Defaults to ``'label'``.
+        chunk_size (int): When set, the output is cut in blocks of exactly
+            this number of samples, aligned on the device sample counter (the
+            first sample of each block has a counter that is a multiple of
+            `chunk_size`). All the complete blocks available are emitted
+            together, so each output has a multiple of `chunk_size` samples.
+            Samples that do not complete a block are kept for the next update.
+            Note that when the counter rolls over, blocks stay aligned only if
+            `chunk_size` is a power of two. When the counter jumps, the
+            incomplete block is dropped and the blocks are aligned again.
+            Defaults to ``None``, which emits all samples as soon as they are
+            read.
+        max_latency (float): Only used with `chunk_size`. Maximum time, in
+            seconds, that a sample may wait in the block buffer. When exceeded,
+            the incomplete block is flushed as is. The next output starts with
+            the rest of that block, so neither of these two outputs has a
+            multiple of `chunk_size` samples. Defaults to ``None``, which never
+            flushes incomplete blocks.
+        trace (str): When set, every data call to the DLL is recorded to a
+            trace file at this path. See :py:mod:`timeflux_amti.trace`.
+        replay (str): When set, the DLL is not loaded and the data calls are
+            replayed from the trace file at this path, as fast as possible and
+            with the recorded host timestamps. Replaying works on any
+            operating system. See :py:mod:`timeflux_amti.trace`.
+        quality (bool): When ``True``, each output sample is checked against
+            the mechanical limits and capacity of the device, and the result is
+            given on the `o_quality` port. See :py:mod:`timeflux_amti.quality`.
+            Defaults to ``False``.
+        near_limit (float): Only used with `quality`. Fraction of the limits
+            over which a sample is flagged as near the limit. Defaults to 0.9.
+        health_interval (float): When set, the dynamic diagnostics (run mode,
+            acquisition rate, setup check, device count, genlock and
+            initialization status) are polled every `health_interval` seconds
+            on a background thread. Changes are sent in the ``health`` key of
+            the metadata of the default output, with only the fields that
+            changed. Defaults to ``None``, which disables the polling.
 
     Attributes:
         i (Port): Default input, listens for a specific event that triggers the
             device zeroing procedure.
         o (Port): Default output, provides a pandas.DataFrame with 8 columns.
+        o_quality (Port): Quality output, only used with `quality`. Provides a
+            pandas.DataFrame with a ``quality`` column, the bitmask of the
+            quality flags of each sample of the default output. Its metadata
+            holds the running count of samples with each flag.
 
     Examples:
 
@@ -128,10 +173,14 @@ class ForceDriver(Node):
     )
     """Supported sampling rates (in Hz) for the AMTI force platform."""
 
-    def __init__(self, rate=500, dll_dir=None, device_index=0, zero_trigger=None, event_label='label'):
+    def __init__(self, rate=500, dll_dir=None, device_index=0, zero_trigger=None, event_label='label',
+                 chunk_size=None, max_latency=None, trace=None, replay=None, quality=False,
+                 near_limit=0.9, health_interval=None):
         super().__init__()
         if rate not in ForceDriver.SAMPLING_RATES:
             raise ValueError('Invalid sampling rate')
+        elif chunk_size is not None and chunk_size <= 0:
+            raise ValueError('Invalid chunk size')
         elif rate > 1000:
             warnings.warn(
                 'Sampling frequencies over 1000Hz are accepted, but the SDK '
@@ -145,27 +194,73 @@ class ForceDriver(Node):
         self._channel_names = ('counter', 'Fx', 'Fy', 'Fz', 'Mx', 'My', 'Mz', 'trigger')
         self._zero_trigger = zero_trigger
         self._event_label = event_label
+        self._chunk_size = chunk_size
+        self._max_latency = max_latency
+        self._trace = trace
+        self._replay = replay
+        self._quality = quality
+        self._near_limit = near_limit
+        self._quality_checker = None
+        self._health_interval = health_interval
+        self._health = None
+        self._health_changes = {}
+        self._health_thread = None
+        self._health_stop = threading.Event()
+        # Serializes the DLL calls between the acquisition and the health polling
+        self._lock = threading.Lock()
+        self._meta_lock = threading.Lock()
+        self._clock = time.time
+        self._sleep = time.sleep
         self._dll = None
         self._buffer = None
         self._start_timestamp = None
         self._reference_ts = None
         self._sample_count = None
         self._diagnostics_dict = None
+        self._device_diagnostics = None
+        self._carry_data = None
+        self._carry_timestamps = None
+        self._carry_since = None
+        self._block_fill = 0
+        self._last_counter = None
         self._init_device()
 
+    @property
+    def diagnostics(self):
+        """Diagnostics of the device, as collected on its initialization"""
+        return self._device_diagnostics
+
+    @property
+    def quality_counts(self):
+        """Running count of samples with each quality flag, or ``None`` when
+        the quality is not checked"""
+        if self._quality_checker is None:
+            return None
+        return dict(self._quality_checker.counts)
+
     @property
     def driver(self):
         """Property for the ctypes.WinDLL interface driver object"""
         if self._dll is None:
-            self.logger.info('Loading DLL AMTIUSBDevice')
-            dll_filename = self._path / 'AMTIUSBDevice.dll'
-            self.logger.info('Attempting to load DLL %s', dll_filename)
-            try:
-                self._dll = ctypes.WinDLL(str(dll_filename.resolve()))
-            except Exception as ex:
-                self.logger.error('Could not load AMTIUSBDevice driver %s.',
-                                  dll_filename, exc_info=True)
-                raise TimefluxAmtiException('Failed to load AMTIUSBDevice') from ex
+            if self._replay is not None:
+                self.logger.info('Replaying DLL data calls from trace %s', self._replay)
+                self._dll = TraceReplayer(self._replay)
+                # Use the recorded time and do not wait for the device
+                self._clock = self._dll.time
+                self._sleep = lambda seconds: None
+            else:
+                self.logger.info('Loading DLL AMTIUSBDevice')
+                dll_filename = self._path / 'AMTIUSBDevice.dll'
+                self.logger.info('Attempting to load DLL %s', dll_filename)
+                try:
+                    self._dll = ctypes.WinDLL(str(dll_filename.resolve()))
+                except Exception as ex:
+                    self.logger.error('Could not load AMTIUSBDevice driver %s.',
+                                      dll_filename, exc_info=True)
+                    raise TimefluxAmtiException('Failed to load AMTIUSBDevice') from ex
+            if self._trace is not None:
+                self.logger.info('Recording DLL data calls to trace %s', self._trace)
+                self._dll = TraceRecorder(self._dll, self._trace)
         return self._dll
 
     def update(self):
@@ -175,8 +270,106 @@ class ForceDriver(Node):
         if self._zero_trigger is not None and self.i.ready():
             trigger = np.any(self.i.data[self._event_label] == self._zero_trigger)
             if trigger:
-                self._zero()
+                self.zero()
+
+        data, timestamps, flags = self._acquire()
+        if data is not None:
+            # Write output to timeflux
+            self.o.set(data, timestamps=timestamps, names=self._channel_names)
+
+            if flags is not None:
+                self.o_quality.set(flags[:, np.newaxis], timestamps=timestamps, names=['quality'])
+                self.o_quality.meta = {'quality': self.quality_counts}
+
+            # Send diagnostic dictionary and health changes as metadata, but
+            # wait until there is data first (otherwise hdf5.save will complain)
+            meta = self._pop_meta()
+            if meta:
+                self.o.meta = meta
+
+    def acquire(self):
+        """Read the available samples, without any port.
+
+        This is the acquisition step of :py:meth:`update`, so that the driver
+        can be used outside of a Timeflux graph.
+
+        Returns:
+            tuple: A ``(data, meta)`` tuple. `data` is a pandas.DataFrame with
+            the 8 channels and, when the quality is checked, a ``quality``
+            column with the bitmask of the quality flags. It is ``None`` when
+            there is no data. `meta` is the metadata that has not been sent
+            yet: the diagnostics (the first time there is data) and, under the
+            ``health`` key, the health changes.
+
+        """
+        data, timestamps, flags = self._acquire()
+        if data is None:
+            return None, {}
+        data = pd.DataFrame(data, index=timestamps, columns=self._channel_names)
+        if flags is not None:
+            data['quality'] = flags
+        return data, self._pop_meta()
+
+    def zero(self):
+        """Zero the device, setting the tare"""
+        self.logger.info('Zeroing the force platform')
+        with self._lock:
+            self.driver.fmBroadcastZero()
+
+    def terminate(self):
+        """Release the DLL and internal variables."""
+        if self._health_thread is not None:
+            self._health_stop.set()
+            self._health_thread.join()
+            self._health_thread = None
+        self._release_device()
+
+    def _pop_meta(self):
+        """Get the metadata that has not been sent yet.
+
+        Returns:
+            dict: The diagnostics (only the first time) and, under the
+            ``health`` key, the health changes since the last call.
+
+        """
+        meta = {}
+        if self._diagnostics_dict is not None:
+            meta.update(self._diagnostics_dict)
+            self._diagnostics_dict = None
+        with self._meta_lock:
+            if self._health_changes:
+                meta['health'] = self._health_changes
+                self._health_changes = {}
+        return meta
+
+    def _acquire(self):
+        """Read the available samples, split them in blocks and check their
+        quality if needed.
+
+        Returns:
+            tuple: A ``(data, timestamps, flags)`` tuple, where `data` and
+            `timestamps` are as in :py:meth:`_read`, and `flags` is the quality
+            bitmask of each sample, or ``None`` when the quality is not
+            checked or there is no data.
 
+        """
+        data, timestamps = self._read()
+        if self._chunk_size is not None:
+            data, timestamps = self._chunk(data, timestamps)
+        flags = None
+        if data is not None and self._quality_checker is not None:
+            flags = self._quality_checker.check(data)
+        return data, timestamps, flags
+
+    def _read(self):
+        """Drain all the samples available on the DLL buffer.
+
+        Returns:
+            tuple: A ``(data, timestamps)`` tuple, where `data` is a numpy array
+            of shape ``(n_samples, 8)`` and `timestamps` a numpy array of
+            datetime64 values. Both are ``None`` when no sample was read.
+
+        """
         # The first time, drop all samples that might have been captured
         # between the initialization and the first time this is called.
         # This step is crucial to get a correct estimation of the drift.
@@ -184,8 +377,9 @@ class ForceDriver(Node):
             n_read = None
             n_drop = 0
             while n_read != 0:
-                n_read = self.driver.fmDLLGetTheFloatDataLBVStyle(self._buffer,
-                                                                  ctypes.sizeof(self._buffer))
+                with self._lock:
+                    n_read = self.driver.fmDLLGetTheFloatDataLBVStyle(self._buffer,
+                                                                      ctypes.sizeof(self._buffer))
                 n_drop += n_read
 
             self.logger.info('Dropped a total of %d samples of data between '
@@ -195,8 +389,9 @@ class ForceDriver(Node):
         data = []
         remaining_samples = None
         while remaining_samples != 0:
-            remaining_samples = self.driver.fmDLLGetTheFloatDataLBVStyle(self._buffer,
-                                                                         ctypes.sizeof(self._buffer))
+            with self._lock:
+                remaining_samples = self.driver.fmDLLGetTheFloatDataLBVStyle(self._buffer,
+                                                                             ctypes.sizeof(self._buffer))
             if remaining_samples:
                 # numpy reshape to two dimensions: sample, channel
                 # Since the dll gives always N values with N a multiple of 8,
@@ -212,7 +407,7 @@ class ForceDriver(Node):
             # account for read data for starting timestamp
             if self._sample_count == 0 and n_samples > 0:
                 self._start_timestamp = (
-                    np.datetime64(int(time.time() * 1e6), 'us') -
+                    np.datetime64(int(self._clock() * 1e6), 'us') -
                     # Adjust for the read samples
                     int(1e6 * n_samples / self._rate)
                 )
@@ -229,7 +424,7 @@ class ForceDriver(Node):
             # sample counting to calculate drift
             self._sample_count += n_samples
             elapsed_seconds = (
-                (np.datetime64(int(time.time() * 1e6), 'us') - self._reference_ts) /
+                (np.datetime64(int(self._clock() * 1e6), 'us') - self._reference_ts) /
                 np.timedelta64(1, 's')
             )
             n_expected = int(np.round(elapsed_seconds * self._rate))
@@ -248,18 +443,104 @@ class ForceDriver(Node):
             )
             self._start_timestamp = timestamps[-1]
 
-            # Write output to timeflux
-            self.o.set(data, timestamps=timestamps[:-1], names=self._channel_names)
+            return data, timestamps[:-1]
 
-            # Send diagnostic dictionary as metadata when it is set, but wait until there is data first
-            # (otherwise hdf5.save will complain)
-            if self._diagnostics_dict is not None:
-                self.o.meta = self._diagnostics_dict
-                self._diagnostics_dict = None
+        return None, None
 
-    def terminate(self):
-        """Release the DLL and internal variables."""
-        self._release_device()
+    def _chunk(self, data, timestamps):
+        """Keep only whole blocks of ``chunk_size`` samples.
+
+        All the complete blocks are returned together. The remaining samples
+        are saved in a carry buffer and prepended to the data of the next call.
+        The carry buffer is flushed when its oldest sample has waited more than
+        ``max_latency`` seconds; in that case, the next emitted samples complete
+        the flushed block so that the following blocks remain aligned.
+
+        When the sample counter jumps (for example, after a DLL buffer
+        overflow), the incomplete block before the jump is dropped and the
+        blocks are aligned again on the counter, dropping the samples before
+        the next block boundary.
+
+        Returns:
+            tuple: A ``(data, timestamps)`` tuple with the samples to emit, or
+            ``(None, None)`` when there is nothing to emit.
+
+        """
+        now = self._clock()
+        blocks = []
+        if data is not None:
+            # Find the counter discontinuities, except for the rollover
+            counter = data[:, 0]
+            previous = counter[0] - 1 if self._last_counter is None else self._last_counter
+            steps = np.diff(counter, prepend=previous)
+            jumps = np.flatnonzero((steps != 1) & (steps != 1 - 2**24))
+            self._last_counter = counter[-1]
+            starts = np.union1d([0], jumps)
+            stops = np.append(starts[1:], data.shape[0])
+            for start, stop in zip(starts, stops):
+                if start in jumps:
+                    blocks.append(self._pop_blocks())
+                    if self._carry_data is not None and self._carry_data.shape[0] > 0:
+                        self.logger.warning('Dropped %d samples of an incomplete block before a '
+                                            'sample counter discontinuity', self._carry_data.shape[0])
+                    self._carry_data = None
+                    self._carry_timestamps = None
+                    self._block_fill = 0
+                self._carry(data[start:stop], timestamps[start:stop], now)
+
+        blocks.append(self._pop_blocks())
+        blocks = [block for block in blocks if block is not None]
+        if not blocks:
+            if (self._carry_data is None or self._carry_data.shape[0] == 0 or
+                    self._max_latency is None or now - self._carry_since < self._max_latency):
+                return None, None
+            self.logger.debug('Flushing incomplete block of %d samples', self._carry_data.shape[0])
+            blocks = [self._pop(self._carry_data.shape[0])]
+
+        self._carry_since = now
+        if len(blocks) == 1:
+            return blocks[0]
+        return np.vstack([block[0] for block in blocks]), np.concatenate([block[1] for block in blocks])
+
+    def _carry(self, data, timestamps, now):
+        """Append contiguous samples to the carry buffer"""
+        if self._carry_data is None:
+            # Drop the samples before the first block boundary so that all
+            # blocks are aligned on the sample counter
+            offset = int(-data[0, 0] % self._chunk_size)
+            if offset:
+                self.logger.info('Dropped %d samples to align output blocks '
+                                 'on the sample counter', min(offset, data.shape[0]))
+            data, timestamps = data[offset:], timestamps[offset:]
+            if data.shape[0] == 0:
+                return
+            self._carry_data = data[:0]
+            self._carry_timestamps = timestamps[:0]
+        if self._carry_data.shape[0] == 0:
+            self._carry_since = now
+        self._carry_data = np.vstack((self._carry_data, data))
+        self._carry_timestamps = np.concatenate((self._carry_timestamps, timestamps))
+
+    def _pop_blocks(self):
+        """Take the samples of the carry buffer up to the last block boundary.
+
+        This takes into account the part of the current block that may have
+        been flushed before.
+
+        """
+        if self._carry_data is None:
+            return None
+        n_carry = self._carry_data.shape[0]
+        n_emit = ((self._block_fill + n_carry) // self._chunk_size) * self._chunk_size - self._block_fill
+        if n_emit <= 0:
+            return None
+        return self._pop(n_emit)
+
+    def _pop(self, n_samples):
+        data, self._carry_data = self._carry_data[:n_samples], self._carry_data[n_samples:]
+        timestamps, self._carry_timestamps = self._carry_timestamps[:n_samples], self._carry_timestamps[n_samples:]
+        self._block_fill = (self._block_fill + n_samples) % self._chunk_size
+        return data, timestamps
 
     def _init_device(self):
         """Perform the device initialization procedure.
@@ -268,7 +549,7 @@ class ForceDriver(Node):
         start acquiring data from it.
 
         """
-        if sys.platform != 'win32':
+        if sys.platform != 'win32' and self._replay is None:
             raise TimefluxAmtiException('This node is supported on Windows only')
 
         # Setup some DLL functions that do not return int but something else
@@ -281,7 +562,7 @@ class ForceDriver(Node):
         self.driver.fmDLLInit()
         retries = 3
         while True:  # TODO: change to self._retry
-            time.sleep(0.250)  # Sleep 250ms as specified in SDK section 20.0
+            self._sleep(0.250)  # Sleep 250ms as specified in SDK section 20.0
             res = self.driver.fmDLLIsDeviceInitComplete()
             if res in (1, 2):
                 self.logger.info('DLL initialized')
@@ -308,6 +589,11 @@ class ForceDriver(Node):
 
         # Log some diagnostics before starting
         self._diagnostics_dict = self._diagnostics()
+        self._device_diagnostics = self._diagnostics_dict
+        if self._quality:
+            self._quality_checker = QualityChecker.from_diagnostics(
+                self._diagnostics_dict, self._dev_index, self._near_limit
+            )
         # Select back the device
         self.driver.fmDLLSelectDeviceIndex(self._dev_index)
 
@@ -323,13 +609,69 @@ class ForceDriver(Node):
 
         # Start DLL acquisition
         self.driver.fmBroadcastStart()
-        self._zero()
-        time.sleep(1)
+        self.zero()
+        self._sleep(1)
 
-    def _zero(self):
-        """Zero the device, setting the tare"""
-        self.logger.info('Zeroing the force platform')
-        self.driver.fmBroadcastZero()
+        # Start polling the device health
+        if self._health_interval is not None:
+            self._health = self._poll_health()
+            self._health_thread = threading.Thread(target=self._health_loop,
+                                                   name='ForceDriverHealth', daemon=True)
+            self._health_thread.start()
+
+    def _poll_health(self):
+        """Read the dynamic diagnostics fields, which are cheap to obtain.
+
+        Returns:
+            dict: The ``general`` fields and the ``device`` fields of the
+            selected device, as in :py:meth:`_diagnostics`.
+
+        """
+        # The lock is taken for each call, so that a data read waits for one
+        # DLL call at most
+        general = dict()
+        for key, function in (('init_complete', 'fmDLLIsDeviceInitComplete'),
+                              ('setup_check', 'fmDLLSetupCheck'),
+                              ('device_count', 'fmDLLGetDeviceCount'),
+                              ('run_mode', 'fmDLLGetRunMode'),
+                              ('genlock', 'fmDLLGetGenlock'),
+                              ('acquisition_rate', 'fmDLLGetAcquisitionRate')):
+            with self._lock:
+                general[key] = getattr(self.driver, function)()
+
+        # Device functions apply to the selected device: keep the selection
+        # and the call together
+        device = dict()
+        for key, function in (('run_mode', 'fmGetRunMode'),
+                              ('acquisition_rate', 'fmGetAcquisitionRate')):
+            with self._lock:
+                self.driver.fmDLLSelectDeviceIndex(self._dev_index)
+                device[key] = getattr(self.driver, function)()
+        return dict(general=general, device=device)
+
+    def _check_health(self):
+        """Poll the device health once and save the fields that changed"""
+        health = self._poll_health()
+        changes = {}
+        for section, fields in health.items():
+            changed = {key: value for key, value in fields.items()
+                       if self._health[section].get(key) != value}
+            if changed:
+                changes[section] = changed
+        if changes:
+            self.logger.warning('AMTI device health changed: %s', changes)
+            self._health = health
+            with self._meta_lock:
+                for section, changed in changes.items():
+                    self._health_changes.setdefault(section, {}).update(changed)
+
+    def _health_loop(self):
+        """Poll the device health until the node is terminated"""
+        while not self._health_stop.wait(self._health_interval):
+            try:
+                self._check_health()
+            except Exception:
+                self.logger.warning('Health polling failed', exc_info=True)
 
     def _release_device(self):
         """Perform the device release procedure.
@@ -342,7 +684,7 @@ class ForceDriver(Node):
         self.driver.fmBroadcastStop()
         self._save_config()
         self.driver.fmDLLShutDown()
-        time.sleep(0.500)  # Sleep 500ms as specified in SDK section 7.0
+        self._sleep(0.500)  # Sleep 500ms as specified in SDK section 7.0
         self.logger.info('Device released')
 
     def _save_config(self):
@@ -500,7 +842,7 @@ class ForceDriver(Node):
         while not result and num_retries > 0:
             if description:
                 self.logger.debug('%s failed, retyring in %f seconds...', description, wait)
-            time.sleep(wait)
+            self._sleep(wait)
             result = predicate()
             num_retries -= 1
         exception = exception or TimefluxAmtiException
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+"""Timeflux AMTI spectral monitor node
+
+Use this node to monitor the noise floor and mains interference of the force
+platform signals.
+"""
+
+import numpy as np
+from timeflux.core.node import Node
+
+
+_windows = {
+    'hann': np.hanning,
+    'hamming': np.hamming,
+    'blackman': np.blackman,
+    'bartlett': np.bartlett,
+}
+
+
+class SpectralMonitor(Node):
+    """ Streaming spectral monitor for the AMTI force platform.
+
+    This node keeps an incremental estimation of the power spectral density
+    (PSD) of each channel using the Welch method: the signal is cut into
+    overlapping segments, each segment is windowed and its periodogram is
+    averaged into the PSD estimate. The average is a running mean for the
+    first segments and an exponential forgetting average afterwards, so that
+    the estimate follows slow changes of the signal.
+
+    Every ``interval`` seconds, the node publishes a single row with the power
+    of the mains interference band (and its harmonics), of any additional
+    band, and an estimation of the noise floor for each channel. The noise
+    floor is the median of the PSD, excluding the DC component and the mains
+    bands, expressed in squared units per Hz.
+
+    The processing cost is bounded per sample: only the samples that do not
+    complete a segment are kept between updates, and each segment (that is,
+    every ``segment_length * (1 - overlap)`` samples) costs one FFT per
+    channel.
+
+    Args:
+        rate (int): Sampling rate of the input, in Hz.
+        segment_length (int): Number of samples of each Welch segment. It
+            sets the frequency resolution to ``rate / segment_length``.
+            Defaults to 512.
+        overlap (float): Fraction of overlap between consecutive segments, in
+            ``[0, 1)``. Defaults to 0.5.
+        forgetting (float): Weight of a new segment in the exponential
+            average, in ``(0, 1]``. The first ``1 / forgetting`` segments are
+            averaged with equal weights. Defaults to 0.05.
+        window (str): Name of the segment window; one of ``'hann'``,
+            ``'hamming'``, ``'blackman'`` or ``'bartlett'``. Defaults to
+            ``'hann'``.
+        columns (list): Names of the input columns to monitor. Defaults to the
+            force and moment channels of
+            :py:class:`timeflux_amti.nodes.driver.ForceDriver`.
+        mains (float): Frequency of the mains, in Hz. Usually 50 or 60.
+            Defaults to 50.
+        harmonics (int): Number of mains harmonics monitored, including the
+            fundamental. Defaults to 3.
+        bandwidth (float): Half-width, in Hz, of each mains band. It is widened
+            to two frequency bins if needed, so that the main lobe of the
+            window is included. Defaults to 1.
+        bands (dict): Additional bands to monitor, as a dictionary of band name
+            to ``[low, high]`` frequencies in Hz. Defaults to no additional
+            bands.
+        interval (float): Time, in seconds, between two publications.
+            Defaults to 1.
+
+    Attributes:
+        i (Port): Default input, expects a pandas.DataFrame such as the output
+            of :py:class:`timeflux_amti.nodes.driver.ForceDriver`.
+        o (Port): Default output, provides a pandas.DataFrame with one row and
+            the columns ``<channel>_<band>`` and ``<channel>_noise_floor``. The
+            mains bands are named ``mains_<frequency>``.
+
+    Examples:
+
+        The following YAML pipeline acquires at 1000 Hz and displays the mains
+        interference every 5 seconds:
+
+        .. code-block:: yaml
+
+           graphs:
+              - nodes:
+                - id: driver
+                  module: timeflux_amti.nodes.driver
+                  class: ForceDriver
+                  params:
+                    rate: 1000
+
+                - id: spectral
+                  module: timeflux_amti.nodes.spectral
+                  class: SpectralMonitor
+                  params:
+                    rate: 1000
+                    mains: 50
+                    interval: 5
+
+                - id: display
+                  module: timeflux.nodes.debug
+                  class: Display
+
+                rate: 20
+
+                edges:
+                  - source: driver
+                    target: spectral
+                  - source: spectral
+                    target: display
+
+    """
+
+    def __init__(self, rate, segment_length=512, overlap=0.5, forgetting=0.05, window='hann',
+                 columns=('Fx', 'Fy', 'Fz', 'Mx', 'My', 'Mz'), mains=50, harmonics=3,
+                 bandwidth=1, bands=None, interval=1):
+        super().__init__()
+        if not 0 <= overlap < 1:
+            raise ValueError('Invalid overlap')
+        if not 0 < forgetting <= 1:
+            raise ValueError('Invalid forgetting factor')
+        if window not in _windows:
+            raise ValueError('Invalid window')
+        self._rate = rate
+        self._nperseg = int(segment_length)
+        self._hop = max(1, int(round(self._nperseg * (1 - overlap))))
+        self._forgetting = forgetting
+        self._columns = list(columns)
+        self._interval = np.timedelta64(int(interval * 1e6), 'us')
+
+        # Precompute the window, the PSD scaling and the frequency bins
+        self._window = _windows[window](self._nperseg)
+        self.frequencies = np.fft.rfftfreq(self._nperseg, 1 / rate)
+        self._scale = np.full(self.frequencies.size, 2 / (rate * np.sum(self._window ** 2)))
+        self._scale[0] /= 2
+        if self._nperseg % 2 == 0:
+            self._scale[-1] /= 2
+        self._resolution = rate / self._nperseg
+
+        # Band masks over the frequency bins
+        self._bands = {}
+        mains_mask = np.zeros(self.frequencies.size, dtype=bool)
+        bandwidth = max(bandwidth, 2 * self._resolution)
+        for k in range(1, harmonics + 1):
+            frequency = k * mains
+            mask = np.abs(self.frequencies - frequency) <= bandwidth
+            mains_mask |= mask
+            self._bands[f'mains_{frequency:g}'] = mask
+        for name, (low, high) in (bands or {}).items():
+            self._bands[name] = (self.frequencies >= low) & (self.frequencies <= high)
+        self._floor_mask = ~mains_mask
+        self._floor_mask[0] = False
+
+        self._names = (
+            [f'{column}_{band}' for column in self._columns for band in self._bands] +
+            [f'{column}_noise_floor' for column in self._columns]
+        )
+        self._buffer = np.empty((0, len(self._columns)))
+        self._psd = None
+        self._n_segments = 0
+        self._last_timestamp = None
+        self._last_publication = None
+
+    def update(self):
+        if not self.i.ready():
+            return
+
+        self._buffer = np.vstack((self._buffer, self.i.data[self._columns].values))
+        self._last_timestamp = self.i.data.index[-1]
+        if self._last_publication is None:
+            self._last_publication = self._last_timestamp
+
+        n_segments = (self._buffer.shape[0] - self._nperseg) // self._hop + 1
+        if n_segments > 0:
+            # Segments as a strided view of shape (segment, channel, sample)
+            segments = np.lib.stride_tricks.sliding_window_view(
+                self._buffer, self._nperseg, axis=0
+            )[:n_segments * self._hop:self._hop]
+            segments = segments - segments.mean(axis=-1, keepdims=True)
+            periodograms = np.abs(np.fft.rfft(segments * self._window, axis=-1)) ** 2 * self._scale
+            self._buffer = self._buffer[n_segments * self._hop:]
+            for periodogram in periodograms:
+                # Skip segments with missing values, they would spoil the average
+                if not np.all(np.isfinite(periodogram)):
+                    continue
+                self._n_segments += 1
+                alpha = max(self._forgetting, 1 / self._n_segments)
+                if self._psd is None:
+                    self._psd = periodogram
+                else:
+                    self._psd = (1 - alpha) * self._psd + alpha * periodogram
+
+        if self._psd is not None and self._last_timestamp - self._last_publication >= self._interval:
+            self._last_publication = self._last_timestamp
+            powers = [
+                self._psd[:, mask].sum(axis=-1) * self._resolution
+                for mask in self._bands.values()
+            ]
+            powers = np.stack(powers, axis=-1).ravel() if powers else np.empty(0)
+            floor = np.median(self._psd[:, self._floor_mask], axis=-1)
+            self.o.set([np.concatenate((powers, floor))],
+                       timestamps=[self._last_timestamp], names=self._names)
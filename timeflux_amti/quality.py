@@ -0,0 +1,121 @@
+"""Quality flags of the AMTI force platform data
+
+The flags are combined in a per-sample bitmask:
+
+* :py:data:`CLIPPING`: a force or moment channel reached the mechanical limits
+  of the platform.
+* :py:data:`NEAR_LIMIT`: a force or moment channel is close to the mechanical
+  limits or to the capacity of the platform.
+* :py:data:`NAN`: a force or moment channel is not a number.
+* :py:data:`STUCK_COUNTER`: the sample counter did not increase since the
+  previous sample, which happens when the DLL buffer overflows and repeats
+  samples.
+
+"""
+
+import numpy as np
+
+
+CLIPPING = 1
+NEAR_LIMIT = 2
+NAN = 4
+STUCK_COUNTER = 8
+
+FLAGS = {
+    'clipping': CLIPPING,
+    'near_limit': NEAR_LIMIT,
+    'nan': NAN,
+    'stuck_counter': STUCK_COUNTER,
+}
+"""Name of each quality flag"""
+
+
+class QualityChecker:
+    """Compute the quality bitmask of force platform data.
+
+    All limits are arrays of six values, for the three forces and the three
+    moments. A channel without a known limit (``None``, or a zero-width
+    mechanical range as given by an unconfigured device) is never flagged as
+    clipping or near its limit.
+
+    Args:
+        low (array): Mechanical minimum of each channel.
+        high (array): Mechanical maximum of each channel.
+        capacity (array): Capacity of the platform on each channel, which
+            applies in both directions.
+        near_limit (float): Fraction of the limits over which a sample is
+            flagged as near the limit. Defaults to 0.9.
+
+    Attributes:
+        counts (dict): Running count of samples with each flag, by flag name.
+
+    """
+
+    def __init__(self, low=None, high=None, capacity=None, near_limit=0.9):
+        inf = np.full(6, np.inf)
+        low = -inf if low is None else np.asarray(low, dtype=float)
+        high = inf if high is None else np.asarray(high, dtype=float)
+        unknown = low >= high
+        self._low = np.where(unknown, -np.inf, low)
+        self._high = np.where(unknown, np.inf, high)
+
+        capacity = inf if capacity is None else np.asarray(capacity, dtype=float)
+        capacity = np.where(capacity > 0, capacity, np.inf)
+        self._near_low = near_limit * np.maximum(self._low, -capacity)
+        self._near_high = near_limit * np.minimum(self._high, capacity)
+
+        self._last_counter = None
+        self.counts = {name: 0 for name in FLAGS}
+
+    @classmethod
+    def from_diagnostics(cls, diagnostics, device_index=0, near_limit=0.9):
+        """Create a checker from the limits of the driver diagnostics.
+
+        Args:
+            diagnostics (dict): Diagnostics, as given by
+                :py:class:`timeflux_amti.nodes.driver.ForceDriver`.
+            device_index (int): Index of the device in the diagnostics.
+            near_limit (float): Fraction of the limits over which a sample is
+                flagged as near the limit.
+
+        """
+        device = diagnostics['devices'][device_index]
+        mechanical = np.asarray(device['limits']['mechanical_max_and_min'], dtype=float)
+        return cls(low=mechanical.min(axis=1),
+                   high=mechanical.max(axis=1),
+                   capacity=device['platform_calibration']['capacity'],
+                   near_limit=near_limit)
+
+    def check(self, data):
+        """Compute the quality bitmask of a chunk and update the counts.
+
+        Args:
+            data (numpy.ndarray): Samples with the 8 columns of the driver
+                output (counter, three forces, three moments, trigger).
+
+        Returns:
+            numpy.ndarray: The uint8 bitmask of each sample.
+
+        """
+        channels = data[:, 1:7]
+        with np.errstate(invalid='ignore'):
+            clipping = np.any((channels <= self._low) | (channels >= self._high), axis=1)
+            near_limit = np.any((channels <= self._near_low) | (channels >= self._near_high), axis=1)
+        nan = np.any(np.isnan(channels), axis=1)
+
+        counter = data[:, 0]
+        previous = counter[0] - 1 if self._last_counter is None else self._last_counter
+        counter = np.concatenate(([previous], counter))
+        # The counter rolls over at 2^24 - 1, which is not a repeated sample
+        stuck = (np.diff(counter) <= 0) & (counter[:-1] != 2**24 - 1)
+        self._last_counter = data[-1, 0]
+
+        flags = (
+            clipping * np.uint8(CLIPPING) |
+            near_limit * np.uint8(NEAR_LIMIT) |
+            nan * np.uint8(NAN) |
+            stuck * np.uint8(STUCK_COUNTER)
+        ).astype(np.uint8)
+        for name, flag in FLAGS.items():
+            self.counts[name] += int(np.count_nonzero(flags & flag))
+        return flags
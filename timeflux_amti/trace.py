@@ -0,0 +1,168 @@
+"""Record and replay traces of the AMTI DLL data calls
+
+A trace is a compact binary file that contains, for each call to
+``fmDLLGetTheFloatDataLBVStyle``, the host timestamp of the call, its return
+value and the contents of the data buffer. Traces are captured with
+:py:class:`TraceRecorder` and fed back with :py:class:`TraceReplayer`, a
+stand-in for the AMTI DLL that works on any operating system. This permits to
+reproduce timing-related problems (overflows, counter jumps, drift) offline and
+deterministically.
+
+The file format is a header (the magic bytes ``AMTITRC`` followed by a
+format version), followed by one record per call. Each record is a
+little-endian ``(float64 timestamp, int32 return value, int32 n_values)``
+header followed by `n_values` float32 values. The buffer values are only
+saved when the return value is not zero.
+
+"""
+
+import ctypes
+import struct
+import time
+
+import numpy as np
+
+from timeflux_amti.exceptions import TimefluxAmtiException
+
+
+MAGIC = b'AMTITRC'
+VERSION = 1
+_HEADER = struct.Struct('<7sB')
+_RECORD = struct.Struct('<dii')
+
+# Values returned by the replayed DLL functions that do not return 1 on success
+_REPLAY_RETURNS = {
+    'fmGetMechanicalMaxAndMin': 0,
+    'fmGetAnalogMaxAndMin': 0,
+}
+
+
+def iter_trace(path):
+    """Iterate over the records of a trace file.
+
+    Args:
+        path (str): Path of the trace file.
+
+    Yields:
+        tuple: A ``(timestamp, retval, values)`` tuple, where `timestamp` is
+        the host time of the call (as given by :py:func:`time.time`), `retval`
+        is the value returned by the DLL and `values` a float32 numpy array
+        with the buffer contents.
+
+    """
+    with open(path, 'rb') as fd:
+        header = fd.read(_HEADER.size)
+        if len(header) != _HEADER.size:
+            raise TimefluxAmtiException(f'Invalid trace file {path}')
+        magic, version = _HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise TimefluxAmtiException(f'Invalid trace file {path}')
+        while True:
+            record = fd.read(_RECORD.size)
+            if len(record) < _RECORD.size:
+                # End of file, or truncated record of an interrupted capture
+                return
+            timestamp, retval, n_values = _RECORD.unpack(record)
+            payload = fd.read(4 * n_values)
+            if len(payload) < 4 * n_values:
+                return
+            yield timestamp, retval, np.frombuffer(payload, dtype='<f4')
+
+
+class TraceRecorder:
+    """Proxy of the AMTI DLL that records its data calls to a trace file.
+
+    All attributes are delegated to the wrapped DLL object, except for
+    ``fmDLLGetTheFloatDataLBVStyle`` which is recorded after each call.
+
+    Args:
+        dll: The DLL object to wrap, usually a ``ctypes.WinDLL``.
+        path (str): Path of the trace file. It is overwritten if it exists.
+
+    """
+
+    def __init__(self, dll, path):
+        self._dll = dll
+        self._fd = open(path, 'wb')
+        self._fd.write(_HEADER.pack(MAGIC, VERSION))
+
+    def __getattr__(self, name):
+        return getattr(self._dll, name)
+
+    def fmDLLGetTheFloatDataLBVStyle(self, buffer, size):
+        retval = self._dll.fmDLLGetTheFloatDataLBVStyle(buffer, size)
+        timestamp = time.time()
+        payload = bytes(buffer)[:size] if retval else b''
+        self._fd.write(_RECORD.pack(timestamp, retval, len(payload) // 4))
+        self._fd.write(payload)
+        return retval
+
+    def fmDLLShutDown(self):
+        retval = self._dll.fmDLLShutDown()
+        self.close()
+        return retval
+
+    def close(self):
+        """Flush and close the trace file"""
+        if not self._fd.closed:
+            self._fd.close()
+
+
+class _ReplayFunction:
+    """Stand-in for a DLL function that always returns a success value"""
+
+    def __init__(self, name):
+        self.__name__ = name
+        self.restype = ctypes.c_int
+
+    def __call__(self, *args):
+        return self.restype(_REPLAY_RETURNS.get(self.__name__, 1)).value
+
+
+class TraceReplayer:
+    """Stand-in of the AMTI DLL that replays a trace file.
+
+    Each call to ``fmDLLGetTheFloatDataLBVStyle`` copies the recorded buffer
+    contents and returns the recorded value. Once the trace is exhausted, it
+    returns 0 (no data). All other DLL functions are accepted and return their
+    success value as expected by
+    :py:class:`timeflux_amti.nodes.driver.ForceDriver`, leaving any output
+    buffer untouched.
+
+    Since the timing of a replay does not depend on the host clock, this class
+    also provides a :py:meth:`time` function that returns the recorded
+    timestamp of the last replayed call.
+
+    Args:
+        path (str): Path of the trace file.
+
+    """
+
+    def __init__(self, path):
+        self._records = iter_trace(path)
+        self._next = next(self._records, None)
+        self._time = self._next[0] if self._next is not None else 0.0
+
+    def __getattr__(self, name):
+        if not name.startswith('fm'):
+            raise AttributeError(name)
+        function = _ReplayFunction(name)
+        setattr(self, name, function)
+        return function
+
+    @property
+    def exhausted(self):
+        """Whether all the records of the trace have been replayed"""
+        return self._next is None
+
+    def time(self):
+        """Recorded host time of the last replayed call"""
+        return self._time
+
+    def fmDLLGetTheFloatDataLBVStyle(self, buffer, size):
+        if self._next is None:
+            return 0
+        self._time, retval, values = self._next
+        self._next = next(self._records, None)
+        ctypes.memmove(buffer, values.tobytes(), min(values.nbytes, size))
+        return retval